@@ -1,563 +1,612 @@
 #!/usr/bin/env python3
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import logging.handlers
+import queue
+import re
 import socket
-import threading
 import time
 import sys
 import os
-import select
+
+logger = logging.getLogger('chat')
+
+RECV_BUFFER_SIZE = 4096
+RECV_POOL_MAX = 256  # scratch buffers kept around for reuse
+MAX_LINE = 8192  # longest command line accepted before the client is dropped
+MAX_OUTQ = 3 * 1024 * 1024  # pending output per client before it is dropped as too slow
+IDLE_TIMEOUT = 60  # seconds without a command before a user is disconnected
+SEND_BUFFER_SIZE = 256 * 1024  # kernel send buffer requested for each socket
+MAX_USERNAME_LENGTH = 32
+# Most buffers handed to one sendmsg() call; more than this is rejected with EMSGSIZE
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:
+    IOV_MAX = 16  # unknown or indeterminate; POSIX guarantees at least this many
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')  # not available on Windows
+_USERNAME_RE = re.compile(r'\A\w{1,%d}\Z' % MAX_USERNAME_LENGTH, re.ASCII)
+
+# Fixed replies, encoded once at import instead of on every send
+_WELCOME = b"INFO Welcome to the chat server! Please login with: LOGIN <username>\n"
+_OK = b"OK\n"
+_PONG = b"PONG\n"
+_INFO_NO_USERS = b"INFO No users online\n"
+_ERR_UNKNOWN_COMMAND = b"ERR Unknown command\n"
+_ERR_INTERNAL = b"ERR Internal server error\n"
+_ERR_LOGIN_FIRST = b"ERR Please login first\n"
+_ERR_EMPTY_MESSAGE = b"ERR Message cannot be empty\n"
+_ERR_EMPTY_USERNAME = b"ERR Username cannot be empty\n"
+_ERR_USERNAME_TOO_LONG = b"ERR Username cannot be longer than %d characters\n" % MAX_USERNAME_LENGTH
+_ERR_USERNAME_CHARS = b"ERR Username can only contain letters, numbers and underscore\n"
+_ERR_USERNAME_TAKEN = b"ERR username-taken\n"
+_ERR_ALREADY_LOGGED_IN = b"ERR Already logged in\n"
+_ERR_DM_USAGE = b"ERR Usage: DM <username> <message>\n"
+# Linux only: ACK immediately instead of waiting for delayed-ACK. The kernel
+# clears the flag again on its own, so it is re-armed after every read.
+TCP_QUICKACK = getattr(socket, 'TCP_QUICKACK', None)
+
+class ProtocolError(Exception):
+    """Raised when a client violates the line protocol and must be disconnected"""
+
+class ClientConnection:
+    """Per-connection state owned by the event loop"""
+    __slots__ = ('sock', 'fd', 'address', 'username', 'buffer', 'outq', 'outq_size', 'dropped')
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.address = address
+        self.username = None
+        self.buffer = bytearray()  # bytes received but not yet framed into lines
+        # Chunks queued for the next writable event. Broadcast payloads are shared
+        # between recipients rather than copied into each queue.
+        self.outq = collections.deque()
+        self.outq_size = 0
+        self.dropped = False  # set once the client is scheduled for disconnection
 
 class ChatServer:
-    def __init__(self, host='localhost', port=4000):
+    def __init__(self, host='localhost', port=4000, enable_idle_cleanup=True):
         self.host = host
         self.port = port
-        self.clients = {}  # username -> (socket, address, last_activity)
+        self.enable_idle_cleanup = enable_idle_cleanup
+        self.clients = {}  # username -> (socket, address, login token)
+        # Kept apart from self.clients so touching a user on every command is a
+        # single float store instead of rebuilding the client tuple
+        self.last_activity = {}  # username -> time.monotonic() of last command
+        # Immutable (username, socket) snapshot of self.clients, rebuilt only when
+        # someone logs in or out so broadcasts and WHO never copy the dict
+        self._clients_view = ()
+        self.connections = {}  # fd -> ClientConnection
+        # Min-heap of (deadline, username, login token); entries whose token no longer
+        # matches self.clients are stale and skipped when popped
+        self._expiry_heap = []
+        self._login_tokens = itertools.count()
         self.server_socket = None
+        self.loop = None
+        self._shutdown = None  # future _serve() waits on until stop() resolves it
         self.running = False
-        self.lock = threading.Lock()
-        
+        # Command verb (uppercase) -> handler(username, args, client_socket, address);
+        # a handler returns the new username after a successful login, else None
+        self._command_handlers = {
+            'LOGIN': self._handle_login_cmd,
+            'MSG': self._handle_msg_cmd,
+            'WHO': self._handle_who_cmd,
+            'DM': self._handle_dm_cmd,
+            'PING': self._handle_ping_cmd,
+        }
+        self._recv_pool = collections.deque()  # free list of recv_into() scratch buffers
+        self.recv_pool_hits = 0
+        self.recv_pool_misses = 0
+        self.dropped_clients = 0  # disconnected for overlong lines or a full send queue
+
     def start(self):
         """Start the chat server"""
+        if sys.platform == 'win32':
+            # The default proactor loop has no add_reader(); use the selector-based loop
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+        try:
+            asyncio.run(self._serve())
+        except Exception as e:
+            logger.error("Failed to start server: %s", e)
+        finally:
+            self.running = False
+            logger.info("Receive buffer pool: %d hits, %d misses", self.recv_pool_hits, self.recv_pool_misses)
+            logger.info("Clients dropped for exceeding buffer limits: %d", self.dropped_clients)
+            logger.info("Server stopped")
+
+    async def _serve(self):
+        """Register the listening socket with the loop's selector and wait for events
+
+        The selector event loop multiplexes every socket through a single
+        selectors.DefaultSelector (epoll on Linux, kqueue on BSD/macOS), so
+        idle clients cost nothing until they become readable.
+        """
+        self.loop = asyncio.get_running_loop()
+        self._shutdown = self.loop.create_future()
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        
+        cleanup_task = None
+
         try:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._tune_socket(self.server_socket)
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(10)
             self.server_socket.setblocking(False)
             self.running = True
-            print(f"Chat server started on {self.host}:{self.port}")
-            print("Waiting for connections...")
-            
-            # Start cleanup thread for idle clients
-            cleanup_thread = threading.Thread(target=self._cleanup_idle_clients, daemon=True)
-            cleanup_thread.start()
-            
-            self._accept_connections()
-                        
-        except Exception as e:
-            print(f"Failed to start server: {e}")
+            logger.info("Chat server started on %s:%s", self.host, self.port)
+            logger.info("Waiting for connections...")
+
+            self.loop.add_reader(self.server_socket, self._on_accept)
+
+            # Start cleanup task for idle clients
+            if self.enable_idle_cleanup:
+                cleanup_task = self.loop.create_task(self._cleanup_idle_clients())
+
+            await self._shutdown
         finally:
-            self.stop()
-            
-    def _accept_connections(self):
-        """Accept new connections using select for better handling"""
-        while self.running:
-            try:
-                read_sockets, _, exception_sockets = select.select([self.server_socket], [], [self.server_socket], 0.5)
-                
-                for sock in read_sockets:
-                    if sock == self.server_socket:
-                        client_socket, address = self.server_socket.accept()
-                        client_socket.setblocking(False)
-                        print(f"New connection from {address}")
-                        
-                        client_thread = threading.Thread(
-                            target=self.handle_client,
-                            args=(client_socket, address),
-                            daemon=True
-                        )
-                        client_thread.start()
-                        
-                for sock in exception_sockets:
-                    print("Exception on server socket")
-                    
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                if self.running:
-                    print(f"Error in accept loop: {e}")
-            
+            # Everything registered with the selector is torn down here, on the loop thread
+            self.running = False
+            if cleanup_task:
+                cleanup_task.cancel()
+            self.loop.remove_reader(self.server_socket)
+            for conn in list(self.connections.values()):
+                self._close_connection(conn)
+            self.server_socket.close()
+
     def stop(self):
-        """Stop the server and close all connections"""
+        """Stop the server and close all connections; safe to call from any thread"""
         self.running = False
-        if self.server_socket:
-            self.server_socket.close()
-        print("Server stopped")
-        
-    def handle_client(self, client_socket, address):
-        """Handle individual client connection"""
-        username = None
-        buffer = ""
-        
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
         try:
-            self._send_message(client_socket, "INFO Welcome to the chat server! Please login with: LOGIN <username>")
-            
-            while self.running:
-                try:
-                    ready = select.select([client_socket], [], [], 0.1)
-                    if ready[0]:
-                        data = client_socket.recv(1024).decode('utf-8')
-                        if not data:
-                            break
-                            
-                        buffer += data
-                        
-                        while '\n' in buffer:
-                            line, buffer = buffer.split('\n', 1)
-                            line = line.strip()
-                            
-                            if not line:
-                                continue
-                                
-                            with self.lock:
-                                if username in self.clients:
-                                    self.clients[username] = (client_socket, address, time.time())
-                            
-                            response = self._process_command(username, line, client_socket)
-                            if response and response != username:
-                                username = response
-                                
-                except BlockingIOError:
-                    continue
-                except socket.error as e:
-                    print(f"Socket error for client {address}: {e}")
-                    break
-                except Exception as e:
-                    print(f"Unexpected error for client {address}: {e}")
-                    break
-                    
-        except Exception as e:
-            print(f"Client {address} error: {e}")
-        finally:
-            if username:
-                self._remove_client(username)
-                self._broadcast_message(f"INFO {username} disconnected")
-            client_socket.close()
-            print(f"Client {address} disconnected")
-            
-    def _process_command(self, username, command, client_socket):
-        """Process a single command from client - CASE INSENSITIVE"""
+            loop.call_soon_threadsafe(self._finish_serving)
+        except RuntimeError:
+            pass  # the loop closed in the meantime
+
+    def _finish_serving(self):
+        """Wake _serve() so it unregisters and closes every socket"""
+        if not self._shutdown.done():
+            self._shutdown.set_result(None)
+
+    def _on_accept(self):
+        """Accept a pending connection and register it with the selector"""
         try:
-            # Convert command to uppercase for comparison, but keep original for message content
-            upper_command = command.upper()
-            
-            if upper_command.startswith('LOGIN '):
-                requested_username = command[6:].strip()
-                return self._handle_login(client_socket, requested_username)
-                
-            elif upper_command.startswith('MSG '):
-                if username:
-                    message = command[4:].strip()
-                    if message:
-                        self._broadcast_message(f"MSG {username} {message}")
-                    else:
-                        self._send_message(client_socket, "ERR Message cannot be empty")
-                else:
-                    self._send_message(client_socket, "ERR Please login first")
-                    
-            elif upper_command == 'WHO':
-                if username:
-                    self._handle_who(client_socket)
-                else:
-                    self._send_message(client_socket, "ERR Please login first")
-                    
-            elif upper_command.startswith('DM '):
-                if username:
-                    self._handle_dm(client_socket, username, command[3:].strip())
-                else:
-                    self._send_message(client_socket, "ERR Please login first")
-                    
-            elif upper_command == 'PING':
-                self._send_message(client_socket, "PONG")
-                
-            else:
-                self._send_message(client_socket, "ERR Unknown command")
-                
-        except Exception as e:
-            print(f"Error processing command: {e}")
-            self._send_message(client_socket, "ERR Internal server error")
-            
-        return username
-        
-    def _handle_login(self, client_socket, requested_username):
-        """Handle user login"""
-        if not requested_username:
-            self._send_message(client_socket, "ERR Username cannot be empty")
-            return None
-            
-        if not all(c.isalnum() or c == '_' for c in requested_username):
-            self._send_message(client_socket, "ERR Username can only contain letters, numbers and underscore")
-            return None
-            
-        with self.lock:
-            if requested_username in self.clients:
-                self._send_message(client_socket, "ERR username-taken")
-                return None
-                
-            self.clients[requested_username] = (client_socket, client_socket.getpeername(), time.time())
-            
-        self._send_message(client_socket, "OK")
-        print(f"User '{requested_username}' logged in")
-        return requested_username
-        
-    def _handle_who(self, client_socket):
-        """Handle WHO command - list active users"""
-        with self.lock:
-            users = list(self.clients.keys())
-            
-        if users:
-            for user in users:
-                self._send_message(client_socket, f"USER {user}")
-        else:
-            self._send_message(client_socket, "INFO No users online")
-            
-    def _handle_dm(self, client_socket, sender, message):
-        """Handle direct messages"""
-        parts = message.split(' ', 1)
-        if len(parts) < 2:
-            self._send_message(client_socket, "ERR Usage: DM <username> <message>")
+            client_socket, address = self.server_socket.accept()
+        except BlockingIOError:
             return
-            
-        target_user, dm_message = parts
-        dm_message = dm_message.strip()
-        
-        if not dm_message:
-            self._send_message(client_socket, "ERR Message cannot be empty")
+        except socket.error as e:
+            if self.running:
+                logger.error("Error in accept loop: %s", e)
             return
-            
-        with self.lock:
-            if target_user in self.clients:
-                target_socket = self.clients[target_user][0]
-                self._send_message(target_socket, f"DM {sender} {dm_message}")
-                self._send_message(client_socket, f"INFO DM sent to {target_user}")
-            else:
-                self._send_message(client_socket, f"ERR User {target_user} not found")
-                
-    def _broadcast_message(self, message, exclude=None):
-        """Broadcast message to all connected clients"""
-        with self.lock:
-            disconnected_users = []
-            for username, (sock, addr, last_activity) in self.clients.items():
-                if username != exclude:
-                    try:
-                        self._send_message(sock, message)
-                    except (socket.error, BrokenPipeError):
-                        disconnected_users.append(username)
-                        
-            for username in disconnected_users:
-                if username in self.clients:
-                    del self.clients[username]
-                    print(f"Removed disconnected user: {username}")
-                
-    def _send_message(self, client_socket, message):
-        """Send message to a client with newline"""
+
         try:
-            client_socket.sendall(f"{message}\n".encode('utf-8'))
-        except (socket.error, BrokenPipeError) as e:
-            print(f"Error sending message: {e}")
-            raise
-            
-    def _remove_client(self, username):
-        """Remove client from active users"""
-        with self.lock:
-            if username in self.clients:
-                del self.clients[username]
-                print(f"User '{username}' removed")
-                
-    def _cleanup_idle_clients(self):
-        """Clean up clients that have been idle for more than 60 seconds"""
-        while self.running:
-            time.sleep(30)
-            current_time = time.time()
-            disconnected_users = []
-            
-            with self.lock:
-                for username, (sock, addr, last_activity) in self.clients.items():
-                    if current_time - last_activity > 60:
-                        print(f"Disconnecting idle user: {username}")
-                        disconnected_users.append(username)
-                        try:
-                            sock.close()
-                        except socket.error:
-                            pass
-                            
-                for username in disconnected_users:
-                    if username in self.clients:
-                        del self.clients[username]
-                        self._broadcast_message(f"INFO {username} disconnected (idle timeout)")
+            client_socket.setblocking(False)
+            self._tune_socket(client_socket)
+        except OSError as e:
+            # e.g. EINVAL on BSD/macOS when the peer already reset the connection
+            logger.warning("Could not set up connection from %s: %s", address, e)
+            client_socket.close()
+            return
+        logger.info("New connection from %s", address)
+
+        conn = ClientConnection(client_socket, address)
+        self.connections[conn.fd] = conn
+        self.loop.add_reader(client_socket, self._on_client_data, client_socket)
 
-def main():
-    port = 4000
-    if 'CHAT_SERVER_PORT' in os.environ:
         try:
-            port = int(os.environ['CHAT_SERVER_PORT'])
-        except ValueError:
-            print("Invalid CHAT_SERVER_PORT environment variable. Using default port 4000.")
-    elif len(sys.argv) > 1:
+            self._send_raw(client_socket, _WELCOME)
+        except socket.error:
+            self._close_connection(conn)
+
+    def _tune_socket(self, sock):
+        """Disable Nagle so short replies go out at once, and enlarge the send buffer"""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+
+    def _on_client_data(self, client_socket):
+        """Read whatever is available on a readable client socket and process complete lines"""
+        conn = self.connections[client_socket.fileno()]
+
+        scratch = self._acquire()
         try:
-            port = int(sys.argv[1])
-        except ValueError:
-            print("Invalid port number. Using default port 4000.")
-    
-    server = ChatServer(port=port)
-    
-    try:
-        server.start()
-    except KeyboardInterrupt:
-        print("\nShutting down server...")
-        server.stop()
+            n = client_socket.recv_into(scratch)
+            conn.buffer += memoryview(scratch)[:n]
+            if n and TCP_QUICKACK is not None:
+                client_socket.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
+        except BlockingIOError:
+            return
+        except socket.error as e:
+            logger.warning("Socket error for client %s: %s", conn.address, e)
+            self._disconnect(conn)
+            return
+        finally:
+            self._release(scratch)
 
-if __name__ == "__main__":
-    main()#!/usr/bin/env python3
-import socket
-import threading
-import sys
-import os
+        if not n:
+            self._disconnect(conn)
+            return
+
+        buf = conn.buffer
 
-class SimpleChatServer:
-    def __init__(self, host='localhost', port=4000):
-        self.host = host
-        self.port = port
-        self.clients = {}  # username -> (socket, address)
-        self.server_socket = None
-        self.running = False
-        self.lock = threading.Lock()
-        
-    def start(self):
-        """Start the chat server"""
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        
         try:
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(10)
-            self.running = True
-            print(f"Chat server started on {self.host}:{self.port}")
-            print("Waiting for connections...")
-            print("Press Ctrl+C to stop the server")
-            
-            while self.running:
-                try:
-                    client_socket, address = self.server_socket.accept()
-                    print(f"New connection from {address}")
-                    
-                    # Handle each client in a separate thread
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, address),
-                        daemon=True
-                    )
-                    client_thread.start()
-                    
-                except KeyboardInterrupt:
+            # Frame the whole batch at once: one decode and one split for every
+            # complete line received, then a single del to drop them from the buffer
+            end = buf.rfind(b'\n')
+            if end == -1:
+                lines = ()
+            else:
+                lines = buf[:end].decode('utf-8', 'replace').split('\n')
+                del buf[:end + 1]
+
+            now = time.monotonic()
+            for line in lines:
+                if conn.dropped:
                     break
-                except Exception as e:
-                    if self.running:
-                        print(f"Error accepting connection: {e}")
-                        
+
+                line = line.strip()
+                if not line:
+                    continue
+
+                if conn.username in self.last_activity:
+                    self.last_activity[conn.username] = now
+
+                response = self._process_command(conn.username, line, client_socket, conn.address)
+                if response and response != conn.username:
+                    conn.username = response
+
+            # Whatever is left has no newline yet; refuse to buffer it without bound
+            if len(buf) > MAX_LINE:
+                raise ProtocolError(f"line exceeds {MAX_LINE} bytes")
+
+        except ProtocolError as e:
+            logger.warning("Dropping client %s: %s", conn.address, e)
+            self.dropped_clients += 1
+            self._disconnect(conn)
         except Exception as e:
-            print(f"Failed to start server: {e}")
-        finally:
-            self.stop()
-            
-    def stop(self):
-        """Stop the server and close all connections"""
-        print("Shutting down server...")
-        self.running = False
-        
-        # Close all client connections
-        with self.lock:
-            for username, (sock, addr) in self.clients.items():
-                try:
-                    sock.close()
-                except:
-                    pass
-            self.clients.clear()
-            
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-        print("Server stopped")
-        
-    def handle_client(self, client_socket, address):
-        """Handle individual client connection"""
-        username = None
-        
+            logger.exception("Unexpected error for client %s: %s", conn.address, e)
+            self._disconnect(conn)
+
+    def _acquire(self):
+        """Take a recv scratch buffer from the pool, allocating one if it is empty"""
         try:
-            self._send_message(client_socket, "INFO Welcome to the chat server! Please login with: LOGIN <username>")
-            
-            while self.running:
-                try:
-                    data = client_socket.recv(1024).decode('utf-8')
-                    if not data:
-                        break  # Client disconnected
-                    
-                    # Process each line
-                    for line in data.split('\n'):
-                        line = line.strip()
-                        if not line:
-                            continue
-                            
-                        print(f"Received from {address}: {line}")
-                        
-                        # Process command
-                        response = self._process_command(username, line, client_socket)
-                        if response and response != username:
-                            username = response
-                            
-                except (ConnectionResetError, ConnectionAbortedError):
-                    break
-                except Exception as e:
-                    print(f"Error handling client {address}: {e}")
-                    break
-                    
+            buf = self._recv_pool.pop()
+        except IndexError:
+            self.recv_pool_misses += 1
+            return bytearray(RECV_BUFFER_SIZE)
+        self.recv_pool_hits += 1
+        return buf
+
+    def _release(self, buf):
+        """Return a scratch buffer to the pool unless it is already full"""
+        if len(self._recv_pool) < RECV_POOL_MAX:
+            self._recv_pool.append(buf)
+
+    def _on_client_writable(self, conn):
+        """Flush as much of a client's write queue as the socket accepts"""
+        outq = conn.outq
+        try:
+            if HAS_SENDMSG:
+                # Scatter-gather: hand the queued chunks to the kernel without joining them
+                n = conn.sock.sendmsg(itertools.islice(outq, IOV_MAX))
+            else:
+                n = conn.sock.send(b"".join(outq))
+        except BlockingIOError:
+            return
+        except socket.error as e:
+            logger.warning("Error sending message: %s", e)
+            self._disconnect(conn)
+            return
+
+        conn.outq_size -= n
+        while n:
+            chunk = outq[0]
+            if n < len(chunk):
+                outq[0] = memoryview(chunk)[n:]
+                break
+            n -= len(chunk)
+            outq.popleft()
+
+        if not outq:
+            self.loop.remove_writer(conn.fd)
+
+    def _disconnect(self, conn):
+        """Tear down a client connection and announce the departure"""
+        if conn.username and self._remove_client(conn.username, conn.sock):
+            self._broadcast_message(f"INFO {conn.username} disconnected")
+        self._close_connection(conn)
+
+    def _close_connection(self, conn):
+        """Unregister a client socket from the selector and close it"""
+        if self.connections.pop(conn.fd, None) is None:
+            return
+        self.loop.remove_reader(conn.fd)
+        self.loop.remove_writer(conn.fd)
+        conn.sock.close()
+        logger.info("Client %s disconnected", conn.address)
+
+    def _process_command(self, username, command, client_socket, address):
+        """Process a single command from client - CASE INSENSITIVE
+
+        Only the verb is uppercased; the rest of the line is passed to the
+        handler untouched so message content keeps its case.
+        """
+        try:
+            parts = command.split(None, 1)
+            handler = self._command_handlers.get(parts[0].upper())
+            if handler is None:
+                self._send_raw(client_socket, _ERR_UNKNOWN_COMMAND)
+            else:
+                args = parts[1] if len(parts) > 1 else ""
+                return handler(username, args, client_socket, address) or username
+
+        except BrokenPipeError:
+            # The sender's own queue overflowed; it is already scheduled for disconnection
+            pass
         except Exception as e:
-            print(f"Client {address} error: {e}")
-        finally:
-            if username:
-                with self.lock:
-                    if username in self.clients:
-                        del self.clients[username]
-                try:
-                    self._broadcast_message(f"INFO {username} disconnected", exclude=username)
-                except:
-                    pass
-                print(f"User '{username}' disconnected")
-                
+            logger.exception("Error processing command: %s", e)
             try:
-                client_socket.close()
-            except:
+                self._send_raw(client_socket, _ERR_INTERNAL)
+            except BrokenPipeError:
                 pass
-            
-    def _process_command(self, username, command, client_socket):
-        """Process commands (case insensitive)"""
-        upper_command = command.upper()
-        
-        if upper_command.startswith('LOGIN '):
-            requested_username = command[6:].strip()
-            return self._handle_login(client_socket, requested_username)
-            
-        elif upper_command.startswith('MSG '):
-            if username:
-                message = command[4:].strip()
-                if message:
-                    self._broadcast_message(f"MSG {username} {message}")
-                else:
-                    self._send_message(client_socket, "ERR Message cannot be empty")
-            else:
-                self._send_message(client_socket, "ERR Please login first")
-                
-        elif upper_command == 'WHO':
-            if username:
-                self._handle_who(client_socket)
-            else:
-                self._send_message(client_socket, "ERR Please login first")
-                
-        elif upper_command.startswith('DM '):
-            if username:
-                self._handle_dm(client_socket, username, command[3:].strip())
-            else:
-                self._send_message(client_socket, "ERR Please login first")
-                
-        elif upper_command == 'PING':
-            self._send_message(client_socket, "PONG")
-            
-        else:
-            self._send_message(client_socket, "ERR Unknown command")
-            
+
         return username
-        
-    def _handle_login(self, client_socket, requested_username):
-        """Handle user login"""
+
+    def _handle_login_cmd(self, username, args, client_socket, address):
+        """LOGIN <username>"""
+        if username:
+            self._send_raw(client_socket, _ERR_ALREADY_LOGGED_IN)
+            return None
+        return self._handle_login(client_socket, address, args)
+
+    def _handle_msg_cmd(self, username, args, client_socket, address):
+        """MSG <text> - broadcast to everyone"""
+        if not username:
+            self._send_raw(client_socket, _ERR_LOGIN_FIRST)
+        elif args:
+            self._broadcast_message(f"MSG {username} {args}")
+        else:
+            self._send_raw(client_socket, _ERR_EMPTY_MESSAGE)
+
+    def _handle_who_cmd(self, username, args, client_socket, address):
+        """WHO - list active users"""
+        if username:
+            self._handle_who(client_socket)
+        else:
+            self._send_raw(client_socket, _ERR_LOGIN_FIRST)
+
+    def _handle_dm_cmd(self, username, args, client_socket, address):
+        """DM <username> <text>"""
+        if username:
+            self._handle_dm(client_socket, username, args)
+        else:
+            self._send_raw(client_socket, _ERR_LOGIN_FIRST)
+
+    def _handle_ping_cmd(self, username, args, client_socket, address):
+        """PING - reply PONG"""
+        self._send_raw(client_socket, _PONG)
+
+    def _handle_login(self, client_socket, address, requested_username):
+        """Handle user login; address is the peer address recorded at accept time"""
         if not requested_username:
-            self._send_message(client_socket, "ERR Username cannot be empty")
+            self._send_raw(client_socket, _ERR_EMPTY_USERNAME)
+            return None
+
+        if not _USERNAME_RE.match(requested_username):
+            if len(requested_username) > MAX_USERNAME_LENGTH:
+                self._send_raw(client_socket, _ERR_USERNAME_TOO_LONG)
+            else:
+                self._send_raw(client_socket, _ERR_USERNAME_CHARS)
+            return None
+
+        if requested_username in self.clients:
+            self._send_raw(client_socket, _ERR_USERNAME_TAKEN)
             return None
-            
-        with self.lock:
-            if requested_username in self.clients:
-                self._send_message(client_socket, "ERR username-taken")
-                return None
-                
-            self.clients[requested_username] = (client_socket, client_socket.getpeername())
-            
-        self._send_message(client_socket, "OK")
-        print(f"User '{requested_username}' logged in")
-        
-        # Notify all users about new user
-        self._broadcast_message(f"INFO {requested_username} joined the chat", exclude=requested_username)
+
+        now = time.monotonic()
+        token = next(self._login_tokens)
+        self.clients[requested_username] = (client_socket, address, token)
+        self.last_activity[requested_username] = now
+        self._publish_clients()
+        if self.enable_idle_cleanup:
+            heapq.heappush(self._expiry_heap, (now + IDLE_TIMEOUT, requested_username, token))
+
+        self._send_raw(client_socket, _OK)
+        logger.info("User '%s' logged in", requested_username)
         return requested_username
-        
+
     def _handle_who(self, client_socket):
-        """List active users"""
-        with self.lock:
-            users = list(self.clients.keys())
-            
+        """Handle WHO command - list active users"""
+        users = self._clients_view
+
         if users:
-            for user in users:
-                self._send_message(client_socket, f"USER {user}")
+            # One payload for the whole listing instead of a send per user
+            payload = "".join(f"USER {user}\n" for user, sock in users).encode('utf-8')
+            self._send_raw(client_socket, payload)
         else:
-            self._send_message(client_socket, "INFO No users online")
-            
+            self._send_raw(client_socket, _INFO_NO_USERS)
+
     def _handle_dm(self, client_socket, sender, message):
         """Handle direct messages"""
-        parts = message.split(' ', 1)
+        parts = message.split(None, 1)
         if len(parts) < 2:
-            self._send_message(client_socket, "ERR Usage: DM <username> <message>")
+            self._send_raw(client_socket, _ERR_DM_USAGE)
             return
-            
+
         target_user, dm_message = parts
         dm_message = dm_message.strip()
-        
+
         if not dm_message:
-            self._send_message(client_socket, "ERR Message cannot be empty")
+            self._send_raw(client_socket, _ERR_EMPTY_MESSAGE)
             return
-            
-        with self.lock:
-            if target_user in self.clients:
-                target_socket = self.clients[target_user][0]
-                try:
-                    self._send_message(target_socket, f"DM {sender} {dm_message}")
-                    self._send_message(client_socket, f"INFO DM sent to {target_user}")
-                except:
-                    self._send_message(client_socket, f"ERR Failed to send DM to {target_user}")
-            else:
-                self._send_message(client_socket, f"ERR User {target_user} not found")
-                
+
+        if target_user in self.clients:
+            target_socket = self.clients[target_user][0]
+            try:
+                self._send_message(target_socket, f"DM {sender} {dm_message}")
+            except (socket.error, BrokenPipeError):
+                self._drop_unreachable(target_user, target_socket)
+                self._send_message(client_socket, f"ERR Failed to send DM to {target_user}")
+                return
+            self._send_message(client_socket, f"INFO DM sent to {target_user}")
+        else:
+            self._send_message(client_socket, f"ERR User {target_user} not found")
+
     def _broadcast_message(self, message, exclude=None):
         """Broadcast message to all connected clients"""
-        with self.lock:
-            disconnected_users = []
-            for username, (sock, addr) in self.clients.items():
-                if username != exclude:
-                    try:
-                        self._send_message(sock, message)
-                    except:
-                        disconnected_users.append(username)
-                        
-            # Remove disconnected clients
-            for username in disconnected_users:
-                if username in self.clients:
-                    del self.clients[username]
-                
+        # Encode once; every recipient queues the same bytes object
+        payload = f"{message}\n".encode('utf-8')
+        for username, sock in self._clients_view:
+            if username != exclude:
+                try:
+                    self._send_raw(sock, payload)
+                except (socket.error, BrokenPipeError):
+                    self._drop_unreachable(username, sock)
+
+    def _drop_unreachable(self, username, sock):
+        """Handle a recipient whose send failed
+
+        A full queue has already scheduled a disconnect that removes and announces
+        the user. If the socket has no open connection at all, nothing is scheduled,
+        so the stale entry is removed here.
+        """
+        if sock.fileno() not in self.connections:
+            self._remove_client(username, sock)
+
     def _send_message(self, client_socket, message):
-        """Send message to a client"""
-        try:
-            client_socket.sendall(f"{message}\n".encode('utf-8'))
-        except:
-            raise
+        """Send message to a client with newline"""
+        self._send_raw(client_socket, message.encode('utf-8'), b"\n")
+
+    def _send_raw(self, client_socket, *chunks):
+        """Queue already encoded bytes for a client; together the chunks must end with a newline
+
+        Payloads queued during one loop iteration are coalesced and written by
+        _on_client_writable() once the socket is writable.
+        """
+        conn = self.connections.get(client_socket.fileno())
+        if conn is None or conn.dropped:
+            raise BrokenPipeError("connection is closed")
+
+        size = sum(map(len, chunks))
+        if conn.outq_size + size > MAX_OUTQ:
+            logger.warning("Dropping slow client %s: send queue full", conn.address)
+            self._schedule_disconnect(conn)
+            raise BrokenPipeError("send queue full")
+
+        if not conn.outq:
+            self.loop.add_writer(conn.fd, self._on_client_writable, conn)
+        conn.outq.extend(chunks)
+        conn.outq_size += size
+
+    def _schedule_disconnect(self, conn):
+        """Drop a client that cannot keep up, without blocking or disturbing the sender
+
+        The disconnect runs on the next loop iteration, so a broadcast in progress
+        finishes its pass over the other recipients first.
+        """
+        if conn.dropped:
+            return
+        conn.dropped = True
+        self.dropped_clients += 1
+        self.loop.call_soon(self._disconnect, conn)
+
+    def _remove_client(self, username, sock=None):
+        """Remove client from active users, returning True if it was still registered
+
+        When sock is given the entry is only removed if it still belongs to that socket.
+        """
+        entry = self.clients.get(username)
+        if entry and (sock is None or entry[0] is sock):
+            del self.clients[username]
+            del self.last_activity[username]
+            self._publish_clients()
+            logger.info("User '%s' removed", username)
+            return True
+        return False
+
+    def _publish_clients(self):
+        """Rebuild the read-only client snapshot after self.clients gained or lost a user"""
+        self._clients_view = tuple((username, entry[0]) for username, entry in self.clients.items())
+
+    async def _cleanup_idle_clients(self):
+        """Clean up clients that have been idle for more than IDLE_TIMEOUT seconds
+
+        Each logged in user has one entry in the expiry heap. Only entries that
+        are due get looked at: an idle user is disconnected, an active one is
+        pushed back with a deadline based on its latest activity.
+        """
+        heap = self._expiry_heap
+        while self.running:
+            current_time = time.monotonic()
+
+            while heap and heap[0][0] <= current_time:
+                deadline, username, token = heapq.heappop(heap)
+                entry = self.clients.get(username)
+                if entry is None or entry[2] != token:
+                    continue
+
+                sock = entry[0]
+                last_activity = self.last_activity[username]
+                if current_time - last_activity < IDLE_TIMEOUT:
+                    heapq.heappush(heap, (last_activity + IDLE_TIMEOUT, username, token))
+                    continue
+
+                logger.info("Disconnecting idle user: %s", username)
+                if self._remove_client(username, sock):
+                    conn = self.connections.get(sock.fileno())
+                    if conn:
+                        self._close_connection(conn)
+                    self._broadcast_message(f"INFO {username} disconnected (idle timeout)")
+
+            # Deadlines only ever move forward, so nothing can come due before heap[0]
+            await asyncio.sleep(heap[0][0] - current_time if heap else IDLE_TIMEOUT)
+
+def _configure_logging(level=logging.INFO):
+    """Route log records through a queue so the event loop never blocks on stdout
+
+    The loop thread only enqueues records; the returned listener formats and
+    writes them from a background thread and must be stopped on exit.
+    """
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
 
 def main():
+    listener = _configure_logging()
     port = 4000
     if 'CHAT_SERVER_PORT' in os.environ:
         try:
             port = int(os.environ['CHAT_SERVER_PORT'])
         except ValueError:
-            print("Invalid CHAT_SERVER_PORT. Using default port 4000.")
+            logger.warning("Invalid CHAT_SERVER_PORT environment variable. Using default port 4000.")
     elif len(sys.argv) > 1:
         try:
             port = int(sys.argv[1])
         except ValueError:
-            print("Invalid port number. Using default port 4000.")
-    
-    server = SimpleChatServer(port=port)
-    
+            logger.warning("Invalid port number. Using default port 4000.")
+
+    server = ChatServer(port=port)
+
     try:
         server.start()
     except KeyboardInterrupt:
-        print("\nShutting down server...")
+        logger.info("Shutting down server...")
         server.stop()
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,59 +1,249 @@
 #!/usr/bin/env python3
 import socket
-import time
 import threading
+import time
+
+import chat_server
+from chat_server import ChatServer
+
+def start_server(enable_idle_cleanup=False):
+    """Run a ChatServer on a free port in a background thread and return it with its port"""
+    server = ChatServer(port=0, enable_idle_cleanup=enable_idle_cleanup)
+    threading.Thread(target=server.start, daemon=True).start()
+    deadline = time.monotonic() + 5
+    while not server.running:
+        if time.monotonic() > deadline:
+            raise RuntimeError("chat server did not start")
+        time.sleep(0.01)
+    return server, server.server_socket.getsockname()[1]
+
+class LineClient:
+    """Blocking newline-framed client used by the scripted checks"""
+    def __init__(self, port, rcvbuf=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if rcvbuf:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.connect(('localhost', port))
+        self.sock.settimeout(5)
+        self.buffer = b""
+        self.readline()  # welcome banner
+
+    def send(self, data):
+        self.sock.sendall(data if isinstance(data, bytes) else data.encode())
+
+    def readline(self):
+        """Return the next line without its newline, or None once the server has closed the socket"""
+        while b"\n" not in self.buffer:
+            try:
+                data = self.sock.recv(65536)
+            except ConnectionResetError:
+                return None
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return line.decode()
+
+    def read_until(self, wanted):
+        """Read lines until `wanted` arrives, returning everything read before it"""
+        lines = []
+        while True:
+            line = self.readline()
+            assert line is not None, f"connection closed waiting for {wanted!r}, got {lines!r}"
+            if line == wanted:
+                return lines
+            lines.append(line)
+
+    def drain(self):
+        """Consume whatever has already arrived without blocking"""
+        self.sock.setblocking(False)
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                self.buffer += data
+        except BlockingIOError:
+            pass
+        finally:
+            self.sock.settimeout(5)
+        *lines, self.buffer = self.buffer.split(b"\n")
+        return [line.decode() for line in lines]
+
+    def login(self, name):
+        self.send(f"LOGIN {name}\n")
+        reply = self.readline()
+        assert reply == "OK", f"LOGIN {name} was answered with {reply!r}"
+
+    def close(self):
+        self.sock.close()
+
+def check_overlong_line(server, port):
+    """A line longer than MAX_LINE gets the connection dropped"""
+    client = LineClient(port)
+    try:
+        client.send(b"x" * 20000)
+    except ConnectionResetError:
+        pass  # the server may already have hung up mid-send
+    assert client.readline() is None, "server kept a connection sending an overlong line"
+    client.close()
+    assert server.dropped_clients == 1, f"dropped_clients is {server.dropped_clients}"
+
+def check_full_send_queue(server, port):
+    """A client that stops reading is dropped once MAX_OUTQ bytes are waiting for it"""
+    slow = LineClient(port, rcvbuf=4096)
+    slow.login("slow")
+    sender = LineClient(port)
+    sender.login("flooder")
+    chunk = "y" * 8000
+    for _ in range(chat_server.MAX_OUTQ // len(chunk) * 2):
+        sender.send(f"MSG {chunk}\n")
+        if "INFO slow disconnected" in sender.drain():
+            break
+    else:
+        sender.read_until("INFO slow disconnected")
+    sender.close()
+    slow.close()
+    assert server.dropped_clients == 2, f"dropped_clients is {server.dropped_clients}"
 
-def test_user(name, messages):
-    """Test a single user"""
-    time.sleep(1)
+def check_long_username(port):
+    """Names over MAX_USERNAME_LENGTH characters are rejected"""
+    client = LineClient(port)
+    client.send("LOGIN %s\n" % ("a" * (chat_server.MAX_USERNAME_LENGTH + 1)))
+    reply = client.readline()
+    assert reply == "ERR Username cannot be longer than 32 characters", f"long name got {reply!r}"
+    client.login("a" * chat_server.MAX_USERNAME_LENGTH)
+    client.close()
+
+def check_tab_separated_dm(port):
+    """DM splits on any whitespace, so tabs work as separators"""
+    carol = LineClient(port)
+    carol.login("carol")
+    dave = LineClient(port)
+    dave.login("dave")
+    carol.send("DM\tdave\thi\n")
+    assert carol.readline() == "INFO DM sent to dave"
+    assert dave.readline() == "DM carol hi"
+    carol.close()
+    dave.close()
+
+def check_relogin_then_disconnect(port):
+    """A second LOGIN is refused, and closing the connection frees the name"""
+    watcher = LineClient(port)
+    watcher.login("watcher")
+    erin = LineClient(port)
+    erin.login("erin")
+    erin.send("LOGIN frank\n")
+    reply = erin.readline()
+    assert reply == "ERR Already logged in", f"second LOGIN got {reply!r}"
+    erin.close()
+    watcher.read_until("INFO erin disconnected")
+    watcher.send("WHO\n")
+    watcher.send("PING\n")
+    users = watcher.read_until("PONG")
+    assert "USER erin" not in users and "USER frank" not in users, f"WHO listed {users!r}"
+    again = LineClient(port)
+    again.login("erin")
+    again.close()
+    watcher.close()
+
+def check_idle_expiry():
+    """Idle users are expired from the heap, and stale entries from earlier logins go with them"""
+    chat_server.IDLE_TIMEOUT = 0.5
+    server, port = start_server(enable_idle_cleanup=True)
+    for _ in range(20):
+        client = LineClient(port)
+        client.login("idler")
+        client.close()
+        time.sleep(0.01)  # let the server see the disconnect before the name is reused
+    client = LineClient(port)
+    client.login("idler")
+    start = time.monotonic()
+    assert client.readline() is None, "idle client was not disconnected"
+    assert time.monotonic() - start < 3, "idle client outlived IDLE_TIMEOUT by too much"
+    client.close()
+    assert "idler" not in server.clients
+    assert server._expiry_heap == [], f"expiry heap kept {server._expiry_heap!r}"
+    server.stop()
+
+def run_user(name, messages, port, logged_in, expected, results):
+    """Drive a single user; results[name] gets the login reply and received MSG lines, or the error"""
     try:
         print(f"\n--- {name} connecting ---")
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.connect(('localhost', 4000))
-        
+        client = socket.create_connection(('localhost', port), timeout=5)
+        reader = client.makefile('r', encoding='utf-8', newline='\n')
+
         # Get welcome
-        print(client.recv(1024).decode().strip())
-        
+        print(reader.readline().strip())
+
         # Login
-        client.send(f"LOGIN {name}\n".encode())
-        time.sleep(0.5)
-        print(f"Login response: {client.recv(1024).decode().strip()}")
-        
-        # Send messages
+        client.sendall(f"LOGIN {name}\n".encode())
+        login_reply = reader.readline().strip()
+        print(f"Login response: {login_reply}")
+
+        # Only start chatting once everyone is logged in, so nobody misses a broadcast
+        logged_in.wait(timeout=5)
         for msg in messages:
-            client.send(f"MSG {msg}\n".encode())
-            time.sleep(2)
-            
-        # Listen for messages
+            client.sendall(f"MSG {msg}\n".encode())
+
+        # Read until every expected broadcast has arrived; a missing one times out
         print(f"{name} listening for messages...")
-        for i in range(5):
-            try:
-                data = client.recv(1024)
-                if data:
-                    print(f"{name} received: {data.decode().strip()}")
-            except:
+        received = []
+        while len(received) < len(expected):
+            line = reader.readline()
+            if not line:
                 break
-            time.sleep(1)
-            
+            line = line.strip()
+            print(f"{name} received: {line}")
+            if line.startswith("MSG "):
+                received.append(line)
+
         client.close()
         print(f"--- {name} disconnected ---")
-        
+        results[name] = (login_reply, received)
+
     except Exception as e:
         print(f"{name} error: {e}")
+        results[name] = e
+
+if __name__ == "__main__":
+    server, port = start_server()
+
+    # Test two users
+    users = [
+        ("alice", ["Hello!", "Is anyone there?", "I'm Alice"]),
+        ("bob", ["Hi Alice!", "I'm here!", "Nice to meet you!"])
+    ]
+    # Broadcasts go to every logged in user, the sender included
+    expected = [f"MSG {name} {msg}" for name, messages in users for msg in messages]
+
+    logged_in = threading.Barrier(len(users))
+    results = {}
+    threads = []
+    for name, messages in users:
+        t = threading.Thread(target=run_user, args=(name, messages, port, logged_in, expected, results))
+        threads.append(t)
+        t.start()
 
-# Test two users
-users = [
-    ("alice", ["Hello!", "Is anyone there?", "I'm Alice"]),
-    ("bob", ["Hi Alice!", "I'm here!", "Nice to meet you!"])
-]
+    for t in threads:
+        t.join()
 
-threads = []
-for name, messages in users:
-    t = threading.Thread(target=test_user, args=(name, messages))
-    threads.append(t)
-    t.start()
+    for name, messages in users:
+        result = results.get(name)
+        assert isinstance(result, tuple), f"{name} failed: {result!r}"
+        login_reply, received = result
+        assert login_reply == "OK", f"{name} login reply was {login_reply!r}"
+        assert sorted(received) == sorted(expected), f"{name} received {received!r}"
+        # Each sender's messages must arrive in the order they were sent
+        for sender, sent in users:
+            assert [m for m in received if m.startswith(f"MSG {sender} ")] == [f"MSG {sender} {m}" for m in sent]
 
-for t in threads:
-    t.join()
+    # Scripted checks for the disconnect and validation paths
+    check_overlong_line(server, port)
+    check_full_send_queue(server, port)
+    check_long_username(port)
+    check_tab_separated_dm(port)
+    check_relogin_then_disconnect(port)
+    check_idle_expiry()
 
-print("\nTest completed!")
\ No newline at end of file
+    print("\nTest completed!")